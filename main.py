@@ -1,10 +1,61 @@
-from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from collections import Counter
+from functools import lru_cache
+import asyncio
+import httpx
+import orjson
+import random
 import re
+import string
 
-app = FastAPI()
+# Reports are immutable, so they're shared across requests and only expire via the TTL.
+# Missing reports are cached too (as None) so repeated lookups don't hit the blob storage.
+_report_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+_MISSING = object()  # Marks a cache miss, since None is a valid cached value
+
+# Blob storage requests that fail with a transport error or one of these statuses (throttling or
+# server errors) are retried up to MAX_RETRIES times, with exponential backoff and jitter
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.2  # Seconds before the first retry; doubles with each attempt
+MAX_RETRY_AFTER = 5  # Longest `Retry-After` (in seconds) we'll wait for before giving up on a 429
+# Deadline (in seconds) for fetching all of a `/usage` call's reports, retries included, so the
+# worst-case latency is bounded however many reports there are
+REPORTS_TIMEOUT = 10
+
+# Longest message text we'll calculate credits for, to bound the work done per request
+MAX_MESSAGE_LENGTH = 1 << 20
+# Only texts up to this length are memoized, with at most CREDITS_CACHE_SIZE entries. That bounds
+# the cache to ~4 MiB of ASCII text (~16 MiB at worst for non-ASCII), rather than letting it hold
+# on to messages of up to MAX_MESSAGE_LENGTH characters
+MAX_CACHED_TEXT_LENGTH = 1024
+CREDITS_CACHE_SIZE = 4096
+
+# Compiled once at import time rather than looked up in `re`'s cache on every `calculate_credits` call
+_WORD_RE = re.compile(r"[a-zA-Z'-]+")
+_VOWELS = frozenset("aeiouAEIOU")
+# Translation tables for the palindrome check: lowercase ASCII letters and drop every non-alphanumeric byte
+_LOWERCASE_TABLE = bytes.maketrans(string.ascii_uppercase.encode(), string.ascii_lowercase.encode())
+_NON_ALNUM_BYTES = bytes(sorted(set(range(128)) - set((string.ascii_letters + string.digits).encode())))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one HTTP client (and its keep-alive connection pool) across all requests, with short
+    # timeouts so a stalled blob storage connection can't hold a request indefinitely
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32),
+        timeout=httpx.Timeout(3.0, connect=1.0)
+    ) as client:
+        app.state.client = client
+        yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -15,8 +66,8 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-@app.get("/usage", status_code=status.HTTP_200_OK, summary="Endpoint to retrieve usage data for the current billing period")
-def get_usage() -> JSONResponse:
+@app.get("/usage", status_code=status.HTTP_200_OK, response_class=ORJSONResponse, response_model=None, summary="Endpoint to retrieve usage data for the current billing period")
+async def get_usage(request: Request) -> ORJSONResponse:
     """
     Returns:
     - dict: A dictionary containing a 'usage' key with a list of usage records.
@@ -32,11 +83,14 @@ def get_usage() -> JSONResponse:
     3. For messages with a 'report_id':
        - Attempts to fetch the report details from:
          `https://owpublic.blob.core.windows.net/tech-task/reports/:id`.
+       - All report requests are issued concurrently once the messages are fetched.
+       - Reports (including missing ones) are cached for 5 minutes across requests.
        - If the report exists, uses the report's 'cost' as the credits consumed.
        - If the report does not exist (HTTP 404), calculates credits based on the message text.
        - If there's another error fetching the report, raises an HTTPException.
     4. For messages without a 'report_id' or with an invalid 'report_id', calculates the credits
-       consumed using the `calculate_credits` function.
+       consumed using the `calculate_credits` function (via `calculate_message_credits`), in a single
+       batch on a worker thread.
     5. Compiles all usage items into a list and returns it in the required JSON format:
        {
            "usage": [
@@ -51,50 +105,184 @@ def get_usage() -> JSONResponse:
        }
 
     Raises:
-    - HTTPException: If there's a failure in fetching messages or reports.
+    - HTTPException: If there's a failure in fetching messages or reports, or a message whose credits
+      must be calculated is longer than `MAX_MESSAGE_LENGTH` characters.
     """
+    client: httpx.AsyncClient = request.app.state.client
     messages_url = "https://owpublic.blob.core.windows.net/tech-task/messages/current-period"
 
     try:
-        messages_response = requests.get(messages_url)
+        messages_response = await get_with_retries(client, messages_url)
         messages_response.raise_for_status()
-        messages = messages_response.json()["messages"]
-    except requests.exceptions.RequestException:
+        messages = orjson.loads(messages_response.content)["messages"]
+    except (httpx.HTTPError, orjson.JSONDecodeError):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch messages")
 
+    # Collect every distinct report id up front and fetch them as one batch
+    report_ids = {message["report_id"] for message in messages if message.get("report_id")}
+    reports = await fetch_reports(client, report_ids)
+
+    # Calculate credits for messages without a report in one batch on a worker thread, so the
+    # CPU-bound work doesn't block the event loop
+    texts = [message.get("text", "") for message in messages if reports.get(message.get("report_id")) is None]
+    if any(len(text) > MAX_MESSAGE_LENGTH for text in texts):
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Message too long to calculate credits")
+    text_credits = []
+    if texts:
+        text_credits = await asyncio.to_thread(lambda: [calculate_message_credits(text) for text in texts])
+    remaining_credits = iter(text_credits)  # Consumed in message order below
+
     usage_list = []
 
     for message in messages:
-        message_id = message.get("id")
-        timestamp = message.get("timestamp")
-        text = message.get("text", "")
-        report_id = message.get("report_id")
-
-        credit_used = 0
-        usage_item = {
-            "message_id": message_id,
-            "timestamp": timestamp
-        }
-
-        if report_id:
-            report_url = f"https://owpublic.blob.core.windows.net/tech-task/reports/{report_id}"
-            report_response = requests.get(report_url)
-            if report_response.status_code == status.HTTP_200_OK:
-                report_data = report_response.json()
-                report_name = report_data.get("name")
-                credit_used = report_data.get("credit_cost", 0)
-                usage_item["report_name"] = report_name
-            elif report_response.status_code == status.HTTP_404_NOT_FOUND:
-                credit_used = calculate_credits(text)
-            else:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch report")
+        message_id, timestamp, report_id = message.get("id"), message.get("timestamp"), message.get("report_id")
+        report_data = reports.get(report_id)
+
+        # Build each item in one go, once its final values are known
+        if report_data is not None:
+            usage_list.append({
+                "message_id": message_id,
+                "timestamp": timestamp,
+                "report_name": report_data.get("name"),
+                "credits_used": report_data.get("credit_cost", 0)
+            })
         else:
-            credit_used = calculate_credits(text)
+            usage_list.append({
+                "message_id": message_id,
+                "timestamp": timestamp,
+                "credits_used": next(remaining_credits)
+            })
 
-        usage_item["credits_used"] = credit_used
-        usage_list.append(usage_item)
+    return ORJSONResponse({"usage": usage_list})
 
-    return JSONResponse(content={"usage": usage_list})
+
+async def fetch_reports(client: httpx.AsyncClient, report_ids: set[str]) -> dict[str, dict | None]:
+    """
+    Fetch a batch of reports, each through `get_report`.
+
+    The blob storage has no batch endpoint, so the requests are issued concurrently instead. With
+    HTTP/2 enabled on the client they are multiplexed over a single connection. Each report is
+    fetched once, however many messages reference it.
+
+    The whole batch must finish within `REPORTS_TIMEOUT` seconds. As soon as one report fails (or
+    the deadline passes), the remaining fetches are cancelled, so none keep calling the blob
+    storage (or retrying) after the response has been sent.
+
+    Parameters:
+    - client (httpx.AsyncClient): The shared HTTP client.
+    - report_ids (set[str]): The distinct ids of the reports to fetch.
+
+    Returns:
+    - dict[str, dict | None]: The report data for each report id, or None if the report does not exist.
+
+    Raises:
+    - HTTPException: If any of the reports fails to be fetched, or the batch takes longer than
+      `REPORTS_TIMEOUT` seconds.
+    """
+    try:
+        async with asyncio.timeout(REPORTS_TIMEOUT), asyncio.TaskGroup() as task_group:
+            tasks = {report_id: task_group.create_task(get_report(client, report_id)) for report_id in report_ids}
+    except* HTTPException as exc_group:
+        raise exc_group.exceptions[0]
+    except* TimeoutError:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch report")
+
+    return {report_id: task.result() for report_id, task in tasks.items()}
+
+
+async def get_report(client: httpx.AsyncClient, report_id: str) -> dict | None:
+    """
+    Fetch a report from `https://owpublic.blob.core.windows.net/tech-task/reports/:id`, serving it
+    from `_report_cache` when possible.
+
+    Parameters:
+    - client (httpx.AsyncClient): The shared HTTP client.
+    - report_id (str): The id of the report.
+
+    Returns:
+    - dict | None: The report data, or None if the report does not exist (HTTP 404).
+
+    Raises:
+    - HTTPException: If the report can't be fetched for any other reason. Failures are not cached.
+    """
+    # A single lookup, so the entry can't expire between checking for it and reading it
+    report_data = _report_cache.get(report_id, _MISSING)
+    if report_data is not _MISSING:
+        return report_data
+
+    try:
+        report_response = await get_with_retries(client, f"https://owpublic.blob.core.windows.net/tech-task/reports/{report_id}")
+    except httpx.HTTPError:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch report")
+
+    if report_response.status_code == status.HTTP_200_OK:
+        try:
+            report_data = orjson.loads(report_response.content)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch report")
+    elif report_response.status_code == status.HTTP_404_NOT_FOUND:
+        report_data = None
+    else:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch report")
+
+    _report_cache[report_id] = report_data
+    return report_data
+
+
+async def get_with_retries(client: httpx.AsyncClient, url: str) -> httpx.Response:
+    """
+    Send a GET request, retrying transport errors and `RETRY_STATUSES` responses with exponential
+    backoff and jitter.
+
+    A 429 response's `Retry-After` header is honored: the retry waits at least that long, and if it
+    asks for more than `MAX_RETRY_AFTER` seconds the 429 is returned without retrying.
+
+    Parameters:
+    - client (httpx.AsyncClient): The shared HTTP client.
+    - url (str): The URL to fetch.
+
+    Returns:
+    - httpx.Response: The first response that isn't retryable, or the last response once the
+      retries are exhausted.
+
+    Raises:
+    - httpx.TransportError: If the last attempt fails with a transport error (including timeouts).
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        try:
+            response = await client.get(url)
+        except httpx.TransportError:
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+            retry_after = get_retry_after(response)
+            if retry_after is not None:
+                if retry_after > MAX_RETRY_AFTER:
+                    return response
+                delay = max(delay, retry_after)
+        await asyncio.sleep(delay)
+
+
+def get_retry_after(response: httpx.Response) -> float | None:
+    """
+    Read the delay requested by a 429 response's `Retry-After` header.
+
+    Parameters:
+    - response (httpx.Response): The response to inspect.
+
+    Returns:
+    - float | None: The delay in seconds, or None if the response isn't a 429 or doesn't give the
+      delay in seconds (the HTTP-date form falls back to the regular backoff).
+    """
+    if response.status_code != status.HTTP_429_TOO_MANY_REQUESTS:
+        return None
+    try:
+        return max(float(response.headers["Retry-After"]), 0)
+    except (KeyError, ValueError):
+        return None
 
 
 def calculate_credits(text: str) -> float:
@@ -111,7 +299,7 @@ def calculate_credits(text: str) -> float:
     1. Base Cost: Start with a base cost of 1 credit.
     2. Character Count: Add 0.05 credits for each character in the message.
     3. Word Length Multipliers:
-        - Extract words using `re.findall(r"[a-zA-Z'-]+", text)`.
+        - Extract words using `_WORD_RE.findall(text)`, where `_WORD_RE` is `re.compile(r"[a-zA-Z'-]+")`.
             - Regex Explanation:
                 - `[a-zA-Z'-]`: Matches any uppercase letter (`A-Z`), lowercase letter (`a-z`), apostrophe (`'`), or hyphen (`-`).
                 - `+`: Matches one or more occurrences of the preceding pattern.
@@ -130,52 +318,92 @@ def calculate_credits(text: str) -> float:
     7. Minimum Cost:
         - Ensure the total credits do not fall below 1 credit.
     8. Palindrome Check:
-        - Clean the text using `re.sub(r'[^A-Za-z0-9]', '', text).lower()`.
-            - Regex Explanation:
-                - `[^A-Za-z0-9]`: Matches any character that is NOT an uppercase letter (`A-Z`), lowercase letter (`a-z`), or digit (`0-9`).
-                - The caret `^` inside `[]` negates the character class.
-                - `re.sub` replaces all non-alphanumeric characters with an empty string.
-            - Converts the text to lowercase to ensure case-insensitive comparison.
-        - If the cleaned text reads the same forwards and backwards, double the total credits.
+        - Clean the text using `text.encode('ascii', 'ignore').translate(_LOWERCASE_TABLE, _NON_ALNUM_BYTES)`.
+            - Explanation:
+                - Encoding to ASCII with `'ignore'` drops every non-ASCII character, none of which are alphanumeric here.
+                - `_NON_ALNUM_BYTES` holds every ASCII byte that is NOT an uppercase letter (`A-Z`), lowercase letter (`a-z`), or digit (`0-9`); `translate` deletes them.
+                - `_LOWERCASE_TABLE` maps uppercase letters to lowercase in the same pass, to ensure case-insensitive comparison.
+        - If the cleaned text reads the same forwards and backwards (see `is_palindrome`), double the total credits.
 
     """
-    total_credits = 1  # Base cost
+    # Credits are accumulated as integer hundredths of a credit, so the sum is exact
+    total_cents = 100  # Base cost
 
     # Character Count Cost
     num_chars = len(text)
-    total_credits += num_chars * 0.05
+    total_cents += num_chars * 5
 
     # Word Length Multipliers
-    words = re.findall(r"[a-zA-Z'-]+", text)
-    for word in words:
-        word_length = len(word)
-        if 1 <= word_length <= 3:
-            total_credits += 0.1
-        elif 4 <= word_length <= 7:
-            total_credits += 0.2
-        elif word_length >= 8:
-            total_credits += 0.3
+    words = _WORD_RE.findall(text)
+    word_lengths = Counter(map(len, words))  # Counted in C rather than by a Python loop per word
+    short_words = word_lengths[1] + word_lengths[2] + word_lengths[3]  # The regex never matches empty words
+    medium_words = word_lengths[4] + word_lengths[5] + word_lengths[6] + word_lengths[7]
+    long_words = len(words) - short_words - medium_words
+    total_cents += 10 * short_words + 20 * medium_words + 30 * long_words
 
     # Third Vowels
-    vowels = 'aeiouAEIOU'
-    third_positions = [i for i in range(2, num_chars, 3)]
-    for i in third_positions:
-        if text[i] in vowels:
-            total_credits += 0.3
+    third_chars = text[2::3]
+    total_cents += 30 * sum(map(third_chars.count, _VOWELS))  # One C-level scan per vowel instead of a Python loop per character
 
     # Length Penalty
     if num_chars > 100:
-        total_credits += 5
+        total_cents += 500
 
     # Unique Word Bonus
-    if len(words) == len(set(words)):
-        total_credits = max(total_credits - 2, 1) # Ensure minimum cost of 1
+    # Stop at the first repeated word rather than building a set of every word
+    seen_words = set()
+    unique_words = True
+    for word in words:
+        if word in seen_words:
+            unique_words = False
+            break
+        seen_words.add(word)
+    if unique_words:
+        total_cents = max(total_cents - 200, 100) # Ensure minimum cost of 1
 
 
     # Palindrome Check
-    cleaned_text = re.sub(r'[^A-Za-z0-9]', '', text).lower()
-    if cleaned_text and cleaned_text == cleaned_text[::-1]:
-        total_credits *= 2
+    cleaned_text = text.encode('ascii', 'ignore').translate(_LOWERCASE_TABLE, _NON_ALNUM_BYTES)
+    if cleaned_text and is_palindrome(cleaned_text):
+        total_cents *= 2
+
 
+    return total_cents / 100 # since the rounding was mentioned in the front end section, I didn't round the results here
 
-    return total_credits # since the rounding was mentioned in the front end section, I didn't round the results here
\ No newline at end of file
+
+_cached_calculate_credits = lru_cache(maxsize=CREDITS_CACHE_SIZE)(calculate_credits)
+
+
+def calculate_message_credits(text: str) -> float:
+    """
+    Calculate the credits consumed by a message, memoizing the results for short texts.
+
+    Repeated messages (greetings, templated prompts) are common and short, so texts of up to
+    `MAX_CACHED_TEXT_LENGTH` characters are served from an LRU cache. Longer texts are always
+    calculated directly, which keeps the cache's memory bounded.
+
+    Parameters:
+    - text (str): The text content of the message.
+
+    Returns:
+    - float: The total credits consumed, as calculated by `calculate_credits`.
+    """
+    if len(text) <= MAX_CACHED_TEXT_LENGTH:
+        return _cached_calculate_credits(text)
+    return calculate_credits(text)
+
+
+def is_palindrome(text: bytes) -> bool:
+    """
+    Check whether a byte string reads the same forwards and backwards.
+
+    Compares the end bytes first, so most non-palindromes are rejected without building a reversed
+    copy; otherwise the whole string is compared against its reverse in C.
+
+    Parameters:
+    - text (bytes): The cleaned text to check.
+
+    Returns:
+    - bool: True if the text is a palindrome (an empty text counts as one).
+    """
+    return text[:1] == text[-1:] and text == text[::-1]
@@ -1,18 +1,37 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch
-import requests
+from unittest.mock import AsyncMock, patch
+import asyncio
+import fastapi.routing
+import httpx
 import json
 import re
-from main import app, calculate_credits
-
-client = TestClient(app)
+import time
+from main import app, calculate_credits, calculate_message_credits, is_palindrome, MAX_RETRIES, _cached_calculate_credits, _report_cache
+
+@pytest.fixture
+def client():
+    # Entering the context runs the app lifespan, which creates the shared HTTP client
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def clear_report_cache():
+    # Reports are cached process-wide, so keep each test's mocked reports isolated
+    _report_cache.clear()
+
+@pytest.fixture(autouse=True)
+def no_retry_backoff():
+    # Retry failed requests immediately so the error tests don't sleep
+    with patch('main.RETRY_BACKOFF', 0):
+        yield
 
 class MockResponse:
-    """A mock response object to simulate requests responses."""
-    def __init__(self, json_data, status_code):
+    """A mock response object to simulate httpx responses."""
+    def __init__(self, json_data, status_code, headers=None):
         self.json_data = json_data
         self.status_code = status_code
+        self.headers = headers or {}
         self.content = json.dumps(json_data).encode('utf-8')
 
     def json(self):
@@ -20,7 +39,7 @@ class MockResponse:
 
     def raise_for_status(self):
         if not (200 <= self.status_code < 300):
-            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+            raise httpx.HTTPStatusError(f"{self.status_code} Error", request=None, response=None)
 
     @property
     def text(self):
@@ -64,9 +83,38 @@ def test_calculate_credits_unique_word_bonus():
 
     assert credits == pytest.approx(expected_credits, 0.0001)
 
+def test_calculate_credits_palindrome():
+    text = "Ab, bA"
+    credits = calculate_credits(text)
+    expected_credits = max(1, 1 + 6 * 0.05 + 2*0.1 + 0.3 - 2)*2  # Base cost + character count + word length + vowel - 2 for uniqueness with minumum of 1 then multplied 2 for Palindrome, ignoring case and punctuation
+    assert credits == pytest.approx(expected_credits, 0.0001)
+
+def test_calculate_message_credits_cached():
+    text = "A message that is sent over and over"
+    _cached_calculate_credits.cache_clear()
+    credits = calculate_message_credits(text)
+    assert calculate_message_credits(text) == credits
+    assert _cached_calculate_credits.cache_info().hits == 1
+    assert calculate_credits(text) == credits
+
+def test_calculate_message_credits_long_text_not_cached():
+    text = "a" * 2000
+    _cached_calculate_credits.cache_clear()
+    assert calculate_message_credits(text) == calculate_credits(text)
+    assert _cached_calculate_credits.cache_info().currsize == 0
 
-def test_get_usage_success():
-    with patch('requests.get') as mock_get:
+def test_is_palindrome():
+    assert is_palindrome(b"")
+    assert is_palindrome(b"a")
+    assert is_palindrome(b"abba")
+    assert is_palindrome(b"racecar")
+    assert not is_palindrome(b"ab")
+    assert not is_palindrome(b"abca")
+
+
+
+def test_get_usage_success(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         # Mock responses
         messages_response = {
             "messages": [
@@ -118,8 +166,8 @@ def test_get_usage_success():
         expected_credits = max(1, 1 + 12 * 0.05 + 2*0.2 -2)  # Base cost + character count + word length - 2 for uniqueness with minumum of 1
         assert msg2["credits_used"] == expected_credits
 
-def test_get_usage_report_404():
-    with patch('requests.get') as mock_get:
+def test_get_usage_report_404(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         messages_response = {
             "messages": [
                 {
@@ -151,8 +199,8 @@ def test_get_usage_report_404():
         expected_credits = calculate_credits("Hello world")
         assert msg["credits_used"] == expected_credits
 
-def test_get_usage_report_error():
-    with patch('requests.get') as mock_get:
+def test_get_usage_report_error(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         messages_response = {
             "messages": [
                 {
@@ -179,8 +227,36 @@ def test_get_usage_report_error():
         data = response.json()
         assert data["detail"] == "Failed to fetch report"
 
-def test_get_usage_messages_error():
-    with patch('requests.get') as mock_get:
+def test_get_usage_report_invalid_json(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        report_response = MockResponse({}, 200)
+        report_response.content = b"<html>"
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            return report_response
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch report"
+
+def test_get_usage_messages_error(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         def mock_get_side_effect(url, *args, **kwargs):
             return MockResponse({}, 500)
 
@@ -189,4 +265,364 @@ def test_get_usage_messages_error():
         response = client.get("/usage")
         assert response.status_code == 500
         data = response.json()
-        assert data["detail"] == "Failed to fetch messages"
\ No newline at end of file
+        assert data["detail"] == "Failed to fetch messages"
+
+        # The messages request is retried before giving up
+        assert mock_get.call_count == MAX_RETRIES + 1
+
+def test_get_usage_report_request_error(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            raise httpx.ConnectError("Connection failed")
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch report"
+
+def test_get_usage_duplicate_report_ids(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                },
+                {
+                    "id": 2,
+                    "timestamp": "2023-10-02T00:00:00Z",
+                    "text": "Hello again",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        report_response = {
+            "id": 123,
+            "name": "Test Report",
+            "credit_cost": 10
+        }
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            elif "reports/123" in url:
+                return MockResponse(report_response, 200)
+            else:
+                return MockResponse({}, 404)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["credits_used"] for item in data["usage"]] == [10, 10]
+
+        # One call for the messages and a single call for the shared report
+        assert mock_get.call_count == 2
+
+def test_get_usage_report_cached_across_requests(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                },
+                {
+                    "id": 2,
+                    "timestamp": "2023-10-02T00:00:00Z",
+                    "text": "Test message",
+                    "report_id": "456"
+                }
+            ]
+        }
+
+        report_response = {
+            "id": 123,
+            "name": "Test Report",
+            "credit_cost": 10
+        }
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            elif "reports/123" in url:
+                return MockResponse(report_response, 200)
+            else:
+                return MockResponse({}, 404)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        first = client.get("/usage")
+        second = client.get("/usage")
+        assert first.json() == second.json()
+
+        # Both reports (found and missing) are only fetched by the first request
+        assert mock_get.call_count == 4
+
+def test_get_usage_message_too_long(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get, patch('main.MAX_MESSAGE_LENGTH', 5):
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world"
+                }
+            ]
+        }
+
+        mock_get.return_value = MockResponse(messages_response, 200)
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Message too long to calculate credits"
+
+def test_get_usage_long_message_with_report(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get, patch('main.MAX_MESSAGE_LENGTH', 5):
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                },
+                {
+                    "id": 2,
+                    "timestamp": "2023-10-02T00:00:00Z",
+                    "text": None,
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        report_response = {
+            "id": 123,
+            "name": "Test Report",
+            "credit_cost": 10
+        }
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            return MockResponse(report_response, 200)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        # The texts are never scored, so neither the length guard nor a null text gets in the way
+        response = client.get("/usage")
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["credits_used"] for item in data["usage"]] == [10, 10]
+
+def test_get_usage_messages_invalid_json(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = MockResponse({}, 200)
+        messages_response.content = b"not json"
+
+        mock_get.return_value = messages_response
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch messages"
+
+def test_get_usage_retries_throttled_requests(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        report_response = {
+            "id": 123,
+            "name": "Test Report",
+            "credit_cost": 10
+        }
+
+        mock_get.side_effect = [
+            MockResponse({}, 429),
+            MockResponse(messages_response, 200),
+            MockResponse({}, 503),
+            MockResponse(report_response, 200)
+        ]
+
+        response = client.get("/usage")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["usage"][0]["credits_used"] == 10
+        assert mock_get.call_count == 4
+
+def test_get_usage_skips_thread_without_texts(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get, patch('main.asyncio.to_thread') as mock_to_thread:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        report_response = {
+            "id": 123,
+            "name": "Test Report",
+            "credit_cost": 10
+        }
+
+        def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            return MockResponse(report_response, 200)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 200
+
+        # Every message is billed by its report, so there's nothing to calculate off the event loop
+        mock_to_thread.assert_not_called()
+
+def test_get_usage_skips_jsonable_encoder(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get, \
+            patch('fastapi.routing.jsonable_encoder', wraps=fastapi.routing.jsonable_encoder) as mock_encoder:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world"
+                }
+            ]
+        }
+
+        mock_get.return_value = MockResponse(messages_response, 200)
+
+        response = client.get("/usage")
+        assert response.status_code == 200
+
+        # The ORJSONResponse is returned as is, without a recursive encoding pass over the usage list
+        mock_encoder.assert_not_called()
+
+def test_get_usage_honors_retry_after(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world"
+                }
+            ]
+        }
+
+        mock_get.side_effect = [
+            MockResponse({}, 429, {"Retry-After": "0.01"}),
+            MockResponse(messages_response, 200)
+        ]
+
+        response = client.get("/usage")
+        assert response.status_code == 200
+        assert mock_get.call_count == 2
+
+def test_get_usage_gives_up_on_long_retry_after(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = MockResponse({}, 429, {"Retry-After": "120"})
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch messages"
+
+        # Retrying sooner than the storage asked for would only add to the throttling
+        assert mock_get.call_count == 1
+
+def test_get_usage_cancels_report_fetches_on_failure(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        messages_response = {
+            "messages": [
+                {
+                    "id": i,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": str(i)
+                }
+                for i in range(20)
+            ]
+        }
+
+        async def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            if url.endswith("/reports/0"):
+                return MockResponse({}, 403)
+            await asyncio.sleep(0.01)
+            return MockResponse({}, 503)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch report"
+
+        # The other fetches are cancelled, so none keep calling the storage (or retrying) afterwards
+        calls = mock_get.call_count
+        time.sleep(0.1)
+        assert mock_get.call_count == calls
+
+def test_get_usage_reports_deadline(client):
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get, patch('main.REPORTS_TIMEOUT', 0.05):
+        messages_response = {
+            "messages": [
+                {
+                    "id": 1,
+                    "timestamp": "2023-10-01T00:00:00Z",
+                    "text": "Hello world",
+                    "report_id": "123"
+                }
+            ]
+        }
+
+        async def mock_get_side_effect(url, *args, **kwargs):
+            if "messages/current-period" in url:
+                return MockResponse(messages_response, 200)
+            await asyncio.sleep(1)
+            return MockResponse({}, 404)
+
+        mock_get.side_effect = mock_get_side_effect
+
+        response = client.get("/usage")
+        assert response.status_code == 500
+        data = response.json()
+        assert data["detail"] == "Failed to fetch report"